@@ -2,39 +2,210 @@
 BGG (BoardGameGeek) XML API client.
 Fetches collection and game details from BGG XML API.
 """
+import os
+import random
+import sys
 import time
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from itertools import islice
+from typing import List, Dict, Any, Optional, Callable, Set
 import requests
-import xml.etree.ElementTree as ET
+import requests_cache
+from requests.adapters import HTTPAdapter
+from lxml import etree as ET
+
+from models import GameDetails, INT_FIELDS, RATING_FIELDS, LINK_BUCKET
 
 log = logging.getLogger(__name__)
 
 BGG_API_BASE = "https://boardgamegeek.com/xmlapi2"
 RETRY_DELAY = 1.5  # initial delay between retries (exponential backoff)
 MAX_RETRIES = 3
+MAX_RETRY_AFTER = 60  # seconds; cap on server-requested waits so a huge Retry-After can't stall a worker
 SEARCH_MAX_RETRIES = 8  # search endpoint is more unreliable, needs more retries
 REQUEST_TIMEOUT = 60  # increased timeout for better reliability
+MAX_CONCURRENT_REQUESTS = 5  # cap on in-flight batch requests to BGG
+MIN_REQUEST_INTERVAL = 0.5  # seconds between request starts, shared by all threads
+THING_BATCH_SIZE = 20  # max ids BGG accepts per /thing request; larger requests are rejected
+CACHE_DIR = ".bgg_cache"  # on-disk caches for BGG data
+CACHE_PATH = os.path.join(CACHE_DIR, "http_cache")  # sqlite file for cached responses
+CACHE_EXPIRE_AFTER = 86400  # seconds; collections rarely change within a day
+
+
+# HEAD statuses that mean the data is ready (200) or HEAD isn't supported
+# (405/501), so the poll moves on to a GET; anything else is retried
+HEAD_READY_CODES = (200, 405, 501)
+
+# Path to the primary <name>; lxml compiles and caches it, so no findall() + loop per item
+PRIMARY_NAME_PATH = 'name[@type="primary"]'
+
+
+class _RateLimiter:
+    """Spaces out request starts across all threads by at least `interval` seconds."""
+    
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+    
+    def wait(self) -> None:
+        """Block until this caller's slot comes up."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_RATE_LIMITER = _RateLimiter(MIN_REQUEST_INTERVAL)
+
+
+class _ThrottledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that takes a slot from the shared rate limiter before sending.
+    Cache hits are answered by the session and never reach the adapter, so
+    only real network requests are throttled.
+    """
+    
+    def send(self, request, **kwargs):
+        _RATE_LIMITER.wait()
+        return super().send(request, **kwargs)
+
+
+def _create_session() -> requests.Session:
+    """
+    Create the shared HTTP session used for all BGG calls.
+    Keep-alive connections are pooled so batches and retries reuse one
+    TCP/TLS connection instead of handshaking for every request.
+    Successful responses are cached on disk, keyed by URL and params, so
+    repeat runs within CACHE_EXPIRE_AFTER skip BGG entirely. Only 200 GETs
+    are cached; 202 "still processing" replies are always re-polled.
+    """
+    session = requests_cache.CachedSession(
+        CACHE_PATH,
+        backend="sqlite",
+        expire_after=CACHE_EXPIRE_AFTER,
+        allowable_codes=(200,),
+        allowable_methods=("GET",),
+    )
+    # Retries are handled by _request_with_retry, not by urllib3
+    adapter = _ThrottledAdapter(pool_connections=10, pool_maxsize=10, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Created on first request, so importing this module doesn't create the cache file
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+
 
+def _get_session() -> requests.Session:
+    """Return the shared session, creating it on first use."""
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                _SESSION = _create_session()
+    return _SESSION
 
-def _request_with_retry(url: str, params: Dict[str, Any] = None, max_retries: int = None) -> Optional[ET.Element]:
-    """Make a request to BGG API with retry logic for rate limiting and timeouts."""
+
+# lxml parsers must not be shared between threads, so keep one per thread
+_parser_local = threading.local()
+
+
+def _xml_parser() -> ET.XMLParser:
+    """Return this thread's reusable XML parser."""
+    parser = getattr(_parser_local, "parser", None)
+    if parser is None:
+        parser = ET.XMLParser(huge_tree=True)
+        _parser_local.parser = parser
+    return parser
+
+
+def _parse_xml(content: bytes) -> ET._Element:
+    """
+    Parse a BGG response body into an element tree.
+    Empty or truncated bodies raise ET.ParseError, so they are retried
+    instead of being accepted as partial results.
+    """
+    return ET.fromstring(content, parser=_xml_parser())
+
+
+def _retry_delay(backoff: float, response: Optional[requests.Response] = None) -> float:
+    """
+    Seconds to wait before the next attempt.
+    Uses the server's Retry-After header (in seconds, capped at
+    MAX_RETRY_AFTER) when present, otherwise the exponential backoff.
+    Jitter is added so concurrent batch workers don't all retry at the
+    same moment.
+    """
+    delay = backoff
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                delay = min(max(0.0, float(retry_after)), MAX_RETRY_AFTER)
+            except ValueError:
+                pass  # HTTP-date form; fall back to the backoff
+    return delay + random.uniform(0, 0.5 * delay)
+
+
+def _request_with_retry(url: str, params: Dict[str, Any] = None, max_retries: int = None,
+                        parse: Callable[[bytes], Any] = _parse_xml) -> Optional[Any]:
+    """
+    Make a request to BGG API with retry logic for rate limiting and timeouts.
+    The response body is handed to `parse` (an element tree by default);
+    parse errors are retried like failed requests.
+    """
     if max_retries is None:
         max_retries = MAX_RETRIES
     
+    session = _get_session()
+    poll_with_head = False
+    
     for attempt in range(max_retries):
-        delay = RETRY_DELAY * (2 ** attempt)  # exponential backoff
+        backoff = RETRY_DELAY * (2 ** attempt)  # exponential backoff
+        delay = _retry_delay(backoff)
         
         try:
-            response = requests.get(url, params=params, timeout=REQUEST_TIMEOUT)
+            if poll_with_head:
+                # While BGG is still preparing the data, poll with HEAD so the
+                # placeholder body isn't downloaded again on every retry
+                head = session.head(url, params=params, timeout=REQUEST_TIMEOUT)
+                if head.status_code not in HEAD_READY_CODES:
+                    # Still processing, throttled or failing: back off without a GET
+                    delay = _retry_delay(backoff, head)
+                    if head.status_code == 202:
+                        log.info(f"BGG still processing request, retrying in {delay:.1f}s...")
+                    else:
+                        log.warning(f"BGG API returned status {head.status_code}, retrying in {delay:.1f}s...")
+                    time.sleep(delay)
+                    continue
+                # Ready (or HEAD not supported): fetch the body with a GET
+            
+            response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
             
             if response.status_code == 200:
                 # Parse XML
-                root = ET.fromstring(response.content)
-                return root
-            elif response.status_code == 202:
+                try:
+                    return parse(response.content)
+                except ET.ParseError:
+                    # Evict the unparseable body so the retry (and later runs)
+                    # fetch it again instead of replaying it from the cache
+                    session.cache.delete(requests=[response.request])
+                    raise
+            
+            delay = _retry_delay(backoff, response)
+            if response.status_code == 202:
                 # BGG returns 202 when data is being processed, retry after delay
                 log.info(f"BGG processing request, retrying in {delay:.1f}s...")
+                poll_with_head = True
                 time.sleep(delay)
                 continue
             else:
@@ -81,22 +252,28 @@ def get_collection(username: str) -> List[Dict[str, Any]]:
         "stats": "1"  # Include stats
     }
     
-    root = _request_with_retry(url, params)
-    if root is None:
+    collection = _request_with_retry(url, params, parse=_parse_collection)
+    if collection is None:
         return []
     
-    # Extract items from response
+    log.info(f"Found {len(collection)} owned games for {username}")
+    return collection
+
+
+def _parse_collection(content: bytes) -> List[Dict[str, Any]]:
+    """
+    Stream-parse a collection response into a list of basic item dicts.
+    Each <item> is discarded once extracted, so large collections never
+    hold the whole document tree in memory.
+    """
     collection = []
-    for item in root.findall("item"):
+    context = ET.iterparse(BytesIO(content), tag="item", huge_tree=True)
+    for _, item in context:
         game_id = item.get("objectid")
-        name_elem = item.find("name")
-        name = name_elem.text if name_elem is not None else ""
-        
-        year_elem = item.find("yearpublished")
-        year = year_elem.text if year_elem is not None else None
-        
-        thumbnail_elem = item.find("thumbnail")
-        thumbnail = thumbnail_elem.text if thumbnail_elem is not None else None
+        # findtext does the lookup and the .text read in one call
+        name = item.findtext("name", "")
+        year = item.findtext("yearpublished")
+        thumbnail = item.findtext("thumbnail")
         
         if game_id:
             collection.append({
@@ -105,158 +282,154 @@ def get_collection(username: str) -> List[Dict[str, Any]]:
                 "year": year,
                 "thumbnail": thumbnail
             })
+        
+        # Release the parsed item and any already-processed siblings
+        item.clear()
+        while item.getprevious() is not None:
+            del item.getparent()[0]
     
-    log.info(f"Found {len(collection)} owned games for {username}")
     return collection
 
 
-def get_things(game_ids: List[str], batch_size: int = 20) -> Dict[str, Dict[str, Any]]:
+def get_things(game_ids: List[str], batch_size: int = THING_BATCH_SIZE,
+               concurrency: int = MAX_CONCURRENT_REQUESTS,
+               skip_ids: Optional[Set[str]] = None) -> Dict[str, GameDetails]:
     """
     Fetch detailed information for a list of game IDs from BGG.
     Returns dict mapping game_id -> game details.
-    Processes in batches to avoid overwhelming the API.
+    Processes in batches, with up to `concurrency` batches in flight at once.
+    Duplicate IDs are fetched once; IDs in `skip_ids` (e.g. already cached
+    by the caller) are not fetched at all.
     """
+    # Drop duplicates while keeping the caller's order
+    game_ids = list(dict.fromkeys(game_ids))
+    if skip_ids:
+        game_ids = [gid for gid in game_ids if gid not in skip_ids]
     if not game_ids:
         return {}
     
     log.info(f"Fetching details for {len(game_ids)} games...")
     
+    batches = [game_ids[i:i + batch_size] for i in range(0, len(game_ids), batch_size)]
+    total_batches = len(batches)
     all_details = {}
     
-    # Process in batches
-    for i in range(0, len(game_ids), batch_size):
-        batch = game_ids[i:i + batch_size]
-        log.info(f"Processing batch {i//batch_size + 1}/{(len(game_ids) + batch_size - 1)//batch_size} ({len(batch)} games)")
-        
-        url = f"{BGG_API_BASE}/thing"
-        params = {
-            "id": ",".join(str(gid) for gid in batch),
-            "stats": "1"
-        }
-        
-        root = _request_with_retry(url, params)
-        if root is None:
-            log.warning(f"Failed to fetch batch starting at index {i}")
-            continue
-        
-        # Process each game in the batch
-        for item in root.findall("item"):
-            game_id = item.get("id")
-            if not game_id:
-                continue
-            
-            # Extract game details
-            game_details = _extract_game_details(item)
-            all_details[game_id] = game_details
-        
-        # Small delay between batches to be nice to BGG
-        if i + batch_size < len(game_ids):
-            time.sleep(0.5)
+    if total_batches == 1 or concurrency <= 1:
+        # Nothing to overlap; skip the pool's thread startup and handoff
+        for batch_number, batch in enumerate(batches, 1):
+            all_details.update(_fetch_things_batch(batch, batch_number, total_batches))
+    else:
+        # Batches are I/O-bound and requests releases the GIL while waiting on the
+        # socket, so a small thread pool overlaps the round-trips to BGG.
+        # Only a bounded window of batches is queued ahead of the consumer
+        # (unlike executor.map, which submits everything up front), so finished
+        # results can't pile up and a failure stops new batches being sent.
+        workers = min(concurrency, total_batches)
+        max_pending = 2 * workers
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for batch_number, batch in enumerate(batches, 1):
+                if len(pending) >= max_pending:
+                    all_details.update(pending.popleft().result())
+                pending.append(executor.submit(_fetch_things_batch, batch, batch_number, total_batches))
+            while pending:
+                all_details.update(pending.popleft().result())
     
     log.info(f"Successfully fetched details for {len(all_details)} games")
     return all_details
 
 
-def _extract_game_details(item: ET.Element) -> Dict[str, Any]:
-    """Extract and normalize game details from BGG API response."""
-    
-    def safe_get_int(text: str, fallback: int = 0) -> int:
-        """Safely convert text to int."""
-        try:
-            return int(text) if text else fallback
-        except (ValueError, TypeError):
-            return fallback
+def _fetch_things_batch(batch: List[str], batch_number: int, total_batches: int) -> Dict[str, GameDetails]:
+    """Fetch and parse details for a single batch of game IDs."""
+    log.info(f"Processing batch {batch_number}/{total_batches} ({len(batch)} games)")
     
-    def safe_get_float(text: str, fallback: float = 0.0) -> float:
-        """Safely convert text to float."""
-        try:
-            return float(text) if text else fallback
-        except (ValueError, TypeError):
-            return fallback
-    
-    # Basic info
-    details = {
-        "id": item.get("id"),
-        "name": "",
-        "description": "",
-        "year": None,
-        "minplayers": None,
-        "maxplayers": None,
-        "playingtime": None,
-        "minage": None,
-        "averagerating": None,
-        "averageweight": None,
-        "mechanics": [],
-        "categories": [],
-        "families": [],
-        "designers": [],
-        "publishers": []
+    url = f"{BGG_API_BASE}/thing"
+    params = {
+        "id": ",".join(str(gid) for gid in batch),
+        "stats": "1"
     }
     
-    # Name (find primary name first)
-    names = item.findall("name")
-    for name in names:
-        if name.get("type") == "primary":
-            details["name"] = name.get("value", "")
-            break
-    
-    # If no primary name found, use first name
-    if not details["name"] and names:
-        details["name"] = names[0].get("value", "")
-    
-    # Description
-    description = item.find("description")
-    details["description"] = description.text if description is not None else ""
-    
-    # Year published
-    year = item.find("yearpublished")
-    details["year"] = safe_get_int(year.get("value")) if year is not None else None
-    
-    # Player counts and time
-    minplayers = item.find("minplayers")
-    details["minplayers"] = safe_get_int(minplayers.get("value")) if minplayers is not None else None
-    
-    maxplayers = item.find("maxplayers")
-    details["maxplayers"] = safe_get_int(maxplayers.get("value")) if maxplayers is not None else None
+    root = _request_with_retry(url, params)
+    if root is None:
+        log.warning(f"Failed to fetch batch {batch_number}/{total_batches}")
+        return {}
     
-    playingtime = item.find("playingtime")
-    details["playingtime"] = safe_get_int(playingtime.get("value")) if playingtime is not None else None
+    # Extract details for each game in the batch, built in one comprehension
+    # over a lazy iterfind rather than a findall() list plus per-item inserts
+    return {
+        item.get("id"): _extract_game_details(item)
+        for item in root.iterfind("item")
+        if item.get("id")
+    }
+
+
+def _safe_int(text: Optional[str], fallback: int = 0) -> int:
+    """Safely convert text to int."""
+    if not text:
+        return fallback
+    try:
+        return int(text)
+    except (ValueError, TypeError):
+        return fallback
+
+
+def _safe_float(text: Optional[str], fallback: float = 0.0) -> float:
+    """Safely convert text to float."""
+    if not text:
+        return fallback
+    try:
+        return float(text)
+    except (ValueError, TypeError):
+        return fallback
+
+
+def _find_name(item: ET._Element) -> Optional[ET._Element]:
+    """Return the item's primary <name> element, or its first <name> if none is primary."""
+    name = item.find(PRIMARY_NAME_PATH)
+    if name is None:
+        name = item.find("name")
+    return name
+
+
+def _extract_game_details(item: ET._Element) -> GameDetails:
+    """Extract and normalize game details from BGG API response."""
     
-    minage = item.find("minage")
-    details["minage"] = safe_get_int(minage.get("value")) if minage is not None else None
+    # Basic info
+    details = GameDetails(id=item.get("id"))
     
-    # Ratings from statistics
-    statistics = item.find("statistics")
-    if statistics is not None:
-        ratings = statistics.find("ratings")
-        if ratings is not None:
-            # Average rating
-            average = ratings.find("average")
-            details["averagerating"] = safe_get_float(average.get("value")) if average is not None else None
-            
-            # Average weight
-            averageweight = ratings.find("averageweight")
-            details["averageweight"] = safe_get_float(averageweight.get("value")) if averageweight is not None else None
+    # Name (primary name, falling back to the first name)
+    name = _find_name(item)
+    if name is not None:
+        details.name = name.get("value", "")
     
-    # Links (mechanics, categories, etc.)
-    links = item.findall("link")
-    for link in links:
-        link_type = link.get("type", "")
-        link_value = link.get("value", "")
-        link_id = link.get("id", "")
+    # Walk the item's children once, dispatching on tag, instead of
+    # re-scanning them with a separate find() per field
+    for child in item:
+        tag = child.tag
         
-        link_obj = {"id": link_id, "name": link_value}
-        
-        if link_type == "boardgamemechanic":
-            details["mechanics"].append(link_obj)
-        elif link_type == "boardgamecategory":
-            details["categories"].append(link_obj)
-        elif link_type == "boardgamefamily":
-            details["families"].append(link_obj)
-        elif link_type == "boardgamedesigner":
-            details["designers"].append(link_obj)
-        elif link_type == "boardgamepublisher":
-            details["publishers"].append(link_obj)
+        if tag == "link":
+            # Links (mechanics, categories, etc.)
+            bucket = LINK_BUCKET.get(child.get("type"))
+            if bucket:
+                # Mechanic/category/etc. names repeat across most of a collection;
+                # interning makes every game share one copy of each string
+                getattr(details, bucket).append({
+                    "id": sys.intern(child.get("id", "")),
+                    "name": sys.intern(child.get("value", "")),
+                })
+        elif tag in INT_FIELDS:
+            # Year published, player counts and time
+            setattr(details, INT_FIELDS[tag], _safe_int(child.get("value")))
+        elif tag == "description":
+            details.description = child.text
+        elif tag == "statistics":
+            # Ratings from statistics
+            ratings = child.find("ratings")
+            if ratings is not None:
+                for stat in ratings:
+                    attr = RATING_FIELDS.get(stat.tag)
+                    if attr:
+                        setattr(details, attr, _safe_float(stat.get("value")))
     
     return details
 
@@ -282,11 +455,11 @@ def search_games(query: str, limit: int = 25) -> List[Dict[str, Any]]:
         return []
     
     results = []
-    items = root.findall("item")
     
-    for item in items[:limit]:
+    # iterfind walks lazily, so only the first `limit` items are visited
+    for item in islice(root.iterfind("item"), limit):
         game_id = item.get("id")
-        name = item.find("name")
+        name = _find_name(item)
         name_text = name.get("value") if name is not None else ""
         
         year = item.find("yearpublished")
@@ -300,4 +473,4 @@ def search_games(query: str, limit: int = 25) -> List[Dict[str, Any]]:
             })
     
     log.info(f"Found {len(results)} games matching '{query}'")
-    return results
\ No newline at end of file
+    return results
@@ -1,16 +1,93 @@
 import argparse
-import json
 import os
 import sys
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List, Tuple
 
-from bgg import get_collection, get_things, search_games
+import orjson
+
+from bgg import (get_collection, get_things, search_games,
+                 CACHE_DIR, CACHE_EXPIRE_AFTER, MAX_CONCURRENT_REQUESTS)
+from models import GameDetails
 from similarity import compute_similarity_edges, compute_cross_similarities
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 log = logging.getLogger(__name__)
 
+DETAILS_CACHE_PATH = os.path.join(CACHE_DIR, "things.json")
+
+
+def load_details_cache(path: str = DETAILS_CACHE_PATH,
+                       max_age: float = CACHE_EXPIRE_AFTER) -> Dict[str, Dict[str, Any]]:
+    """
+    Load cached per-game details, dropping entries older than max_age seconds.
+    Returns dict mapping game_id -> {"fetched_at": timestamp, "details": dict}.
+    """
+    try:
+        with open(path, "rb") as f:
+            entries = orjson.loads(f.read())
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        log.warning(f"Ignoring unreadable details cache {path}: {e}")
+        return {}
+    
+    cutoff = time.time() - max_age
+    return {gid: entry for gid, entry in entries.items() if entry.get("fetched_at", 0) >= cutoff}
+
+
+def save_details_cache(entries: Dict[str, Dict[str, Any]], path: str = DETAILS_CACHE_PATH) -> None:
+    """Write the details cache, replacing the old file only once fully written."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(entries))
+    os.replace(tmp_path, path)
+
+
+def write_json(path: str, data: Any) -> None:
+    """Write data as 2-space indented UTF-8 JSON, encoded straight to bytes by orjson."""
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+
+
+def fetch_details(ids: List[str], cache_path: str = DETAILS_CACHE_PATH) -> Dict[str, GameDetails]:
+    """
+    Fetch game details, reusing per-game entries cached by earlier runs.
+    Only ids missing from the cache (or expired) are requested from BGG, so
+    adding a game to the collection costs one small fetch instead of
+    re-fetching every batch.
+    """
+    entries = load_details_cache(cache_path)
+    
+    details = {}
+    for gid in ids:
+        entry = entries.get(gid)
+        if entry is None:
+            continue
+        try:
+            details[gid] = GameDetails.from_dict(entry["details"])
+        except (KeyError, TypeError):
+            # Written by an older GameDetails layout; fetch it again
+            entries.pop(gid)
+    
+    if details:
+        log.info(f"Using cached details for {len(details)}/{len(ids)} games")
+    
+    fetched = get_things(ids, skip_ids=set(details))
+    if fetched:
+        now = time.time()
+        for gid, game in fetched.items():
+            entries[gid] = {"fetched_at": now, "details": game.to_dict()}
+        save_details_cache(entries, cache_path)
+        details.update(fetched)
+    
+    # Keep the caller's ordering regardless of where each game came from
+    return {gid: details[gid] for gid in dict.fromkeys(ids) if gid in details}
+
+
 def main():
     parser = argparse.ArgumentParser(description="Generate JSON data for the web app (nodes.json, edges.json, recs.json).")
     parser.add_argument("--username", required=True, help="BGG username")
@@ -32,43 +109,42 @@ def main():
 
     ids = [item["id"] for item in collection]
     log.info(f"Found {len(ids)} owned games. Fetching details...")
-    details = get_things(ids)
+    details = fetch_details(ids)
 
     # Fill missing names from collection, if needed
     for item in collection:
         gid = item["id"]
-        if gid in details and not details[gid].get("name"):
-            details[gid]["name"] = item.get("name")
+        if gid in details and not details[gid].name:
+            details[gid].name = item.get("name")
 
     log.info("Computing similarities...")
     edges_list = compute_similarity_edges(details, edge_threshold=args.edge_threshold)
     log.info(f"Built {len(edges_list)} edges with threshold {args.edge_threshold}.")
 
     # Serialize nodes and edges for the frontend
-    nodes = []
-    for gid, g in details.items():
-        nodes.append({
+    nodes = [
+        {
             "id": gid,
-            "label": g.get("name"),
-            "name": g.get("name"),
-            "mechanics": [m.get("name") for m in g.get("mechanics", [])],
-            "categories": [c.get("name") for c in g.get("categories", [])],
-            "averageweight": g.get("averageweight"),
-            "averagerating": g.get("averagerating"),
-            "playingtime": g.get("playingtime"),
-            "minplayers": g.get("minplayers"),
-            "maxplayers": g.get("maxplayers"),
+            "label": g.name,
+            "name": g.name,
+            "mechanics": [m.get("name") for m in g.mechanics],
+            "categories": [c.get("name") for c in g.categories],
+            "averageweight": g.averageweight,
+            "averagerating": g.averagerating,
+            "playingtime": g.playingtime,
+            "minplayers": g.minplayers,
+            "maxplayers": g.maxplayers,
             "bggUrl": f"https://boardgamegeek.com/boardgame/{gid}",
-        })
+        }
+        for gid, g in details.items()
+    ]
 
     edges = [{"source": a, "target": b, "weight": w} for a, b, w in edges_list]
 
     nodes_path = os.path.join(args.out_dir, "nodes.json")
     edges_path = os.path.join(args.out_dir, "edges.json")
-    with open(nodes_path, "w", encoding="utf-8") as f:
-        json.dump(nodes, f, ensure_ascii=False, indent=2)
-    with open(edges_path, "w", encoding="utf-8") as f:
-        json.dump(edges, f, ensure_ascii=False, indent=2)
+    write_json(nodes_path, nodes)
+    write_json(edges_path, edges)
 
     log.info(f"Wrote {nodes_path}")
     log.info(f"Wrote {edges_path}")
@@ -80,8 +156,7 @@ def main():
             recommendations = generate_recommendations(details, args.rec_search_terms)
             
             recs_path = os.path.join(args.out_dir, "recs.json")
-            with open(recs_path, "w", encoding="utf-8") as f:
-                json.dump(recommendations, f, ensure_ascii=False, indent=2)
+            write_json(recs_path, recommendations)
             
             log.info(f"Wrote {recs_path}")
         except Exception as e:
@@ -89,43 +164,44 @@ def main():
             log.info("Continuing without recommendations...")
             # Create empty recommendations file as fallback
             recs_path = os.path.join(args.out_dir, "recs.json")
-            with open(recs_path, "w", encoding="utf-8") as f:
-                json.dump({}, f, ensure_ascii=False, indent=2)
+            write_json(recs_path, {})
             log.info(f"Created empty {recs_path}")
     else:
         log.info("Skipping recommendations generation")
 
 
-def generate_recommendations(owned_games: Dict[str, Dict[str, Any]], 
+def generate_recommendations(owned_games: Dict[str, GameDetails], 
                            search_terms: List[str],
                            candidates_per_term: int = 15,
                            max_candidates: int = 100) -> Dict[str, List[Dict[str, Any]]]:
     """
     Generate game recommendations by searching for candidates and computing similarities.
     """
+    # A repeated term would be searched twice, since concurrent calls can't share results
+    search_terms = list(dict.fromkeys(search_terms))
     log.info(f"Searching for recommendation candidates using {len(search_terms)} search terms...")
     
-    # Collect candidate games from search terms
-    candidate_games = {}
-    owned_ids = set(owned_games.keys())
-    
-    for term in search_terms:
+    # Run the searches concurrently (the shared rate limiter in bgg still
+    # spaces the requests); results come back in search-term order
+    def search(term: str) -> List[Dict[str, Any]]:
         log.info(f"Searching for: {term}")
         try:
-            search_results = search_games(term, limit=candidates_per_term)
-            
-            for result in search_results:
-                candidate_id = result["id"]
-                # Skip games already owned
-                if candidate_id not in owned_ids:
-                    candidate_games[candidate_id] = {
-                        "id": candidate_id,
-                        "name": result["name"],
-                        "year": result.get("year")
-                    }
+            return search_games(term, limit=candidates_per_term)
         except Exception as e:
             log.warning(f"Failed to search for '{term}': {e}")
-            continue
+            return []
+    
+    workers = max(1, min(len(search_terms), MAX_CONCURRENT_REQUESTS))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(search, search_terms))
+    
+    # Collect unique candidates, skipping games already owned
+    candidate_games = {
+        result["id"]: {"id": result["id"], "name": result["name"], "year": result.get("year")}
+        for search_results in results
+        for result in search_results
+        if result["id"] not in owned_games
+    }
     
     log.info(f"Found {len(candidate_games)} unique candidate games")
     
@@ -138,7 +214,7 @@ def generate_recommendations(owned_games: Dict[str, Dict[str, Any]],
     # Fetch detailed information for candidates
     if candidate_games:
         log.info("Fetching detailed information for candidates...")
-        candidate_details = get_things(list(candidate_games.keys()))
+        candidate_details = fetch_details(list(candidate_games.keys()))
         
         # Compute cross-similarities between owned games and candidates
         recommendations = compute_cross_similarities(owned_games, candidate_details, top_k=5)
@@ -0,0 +1,75 @@
+"""
+Board game records shared by the BGG client and the similarity code.
+Kept free of HTTP and XML dependencies so similarity can import them alone.
+"""
+import sys
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Any, Optional
+
+
+@dataclass(slots=True)
+class GameDetails:
+    """
+    Normalized details for one game from the /thing endpoint.
+    Slotted so large collections don't carry a per-record dict; links are
+    lists of {"id", "name"} dicts, matching the exported JSON.
+    """
+    id: str
+    name: str = ""
+    description: Optional[str] = ""
+    year: Optional[int] = None
+    minplayers: Optional[int] = None
+    maxplayers: Optional[int] = None
+    playingtime: Optional[int] = None
+    minage: Optional[int] = None
+    averagerating: Optional[float] = None
+    averageweight: Optional[float] = None
+    mechanics: List[Dict[str, str]] = field(default_factory=list)
+    categories: List[Dict[str, str]] = field(default_factory=list)
+    families: List[Dict[str, str]] = field(default_factory=list)
+    designers: List[Dict[str, str]] = field(default_factory=list)
+    publishers: List[Dict[str, str]] = field(default_factory=list)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the details as a plain dict for JSON serialization."""
+        return asdict(self)
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "GameDetails":
+        """
+        Rebuild details written by to_dict (e.g. from the JSON details cache).
+        Link ids and names are interned as when parsed from XML, so cached
+        games share one copy of each repeated string too.
+        """
+        details = cls(**data)
+        for bucket in LINK_BUCKET.values():
+            setattr(details, bucket, [
+                {"id": sys.intern(link["id"]), "name": sys.intern(link["name"])}
+                for link in getattr(details, bucket)
+            ])
+        return details
+
+
+# Child tags of a <item> holding an integer "value" attribute -> GameDetails attribute
+INT_FIELDS = {
+    "yearpublished": "year",
+    "minplayers": "minplayers",
+    "maxplayers": "maxplayers",
+    "playingtime": "playingtime",
+    "minage": "minage",
+}
+
+# Children of <statistics><ratings> holding a float "value" attribute -> GameDetails attribute
+RATING_FIELDS = {
+    "average": "averagerating",
+    "averageweight": "averageweight",
+}
+
+# <link> type attribute -> GameDetails list the link belongs in
+LINK_BUCKET = {
+    "boardgamemechanic": "mechanics",
+    "boardgamecategory": "categories",
+    "boardgamefamily": "families",
+    "boardgamedesigner": "designers",
+    "boardgamepublisher": "publishers",
+}
@@ -3,123 +3,200 @@ Similarity computation for board games.
 Computes pairwise similarity scores based on mechanics, categories, and numeric features.
 """
 import logging
-import math
-from typing import Dict, Any, List, Tuple, Set
+from dataclasses import dataclass
+from typing import Dict, Any, List, Tuple, AbstractSet, FrozenSet, Union
+
+import numpy as np
+
+from models import GameDetails
 
 log = logging.getLogger(__name__)
 
+# GameDetails attributes compared by cosine similarity, in feature-vector order
+NUMERIC_FEATURES = ["averagerating", "averageweight", "playingtime", "minplayers", "maxplayers", "minage"]
+
+# Block similarities are computed in float32 (half the memory traffic of
+# float64); scores are reported to the precision float32 actually carries
+FEATURE_DTYPE = np.float32
+SCORE_DECIMALS = 6
+
+# Games per side of a similarity tile in compute_similarity_edges; a few
+# 256 x 256 float32 tiles fit in L2 cache, so large collections never
+# materialize the full N x N matrix
+SIMILARITY_TILE_SIZE = 256
 
-def jaccard_similarity(set1: Set[str], set2: Set[str]) -> float:
-    """Compute Jaccard similarity between two sets."""
-    if not set1 and not set2:
-        return 1.0  # Both empty sets are identical
-    if not set1 or not set2:
-        return 0.0  # One empty, one non-empty
+# Row selection for similarity_block: explicit row indices, a slice (a view,
+# no copy), or None for all rows
+Rows = Union[List[int], slice, None]
+
+
+def tag_indicator_matrix(tag_sets: List[AbstractSet[str]]) -> np.ndarray:
+    """
+    Build a game x tag indicator matrix: row i has a 1.0 in the column of
+    every tag in tag_sets[i]. Columns are shared across all rows, so any
+    two row blocks can be compared with jaccard_matrix.
+    """
+    # Each tag string is hashed once here to get its integer column id; all
+    # set comparisons afterwards are integer matrix arithmetic
+    vocabulary: Dict[str, int] = {}
+    rows, cols = [], []
+    for row, tags in enumerate(tag_sets):
+        for tag in tags:
+            rows.append(row)
+            cols.append(vocabulary.setdefault(tag, len(vocabulary)))
     
-    intersection = len(set1.intersection(set2))
-    union = len(set1.union(set2))
+    # Small integer counts are exact in float32, so Jaccard loses nothing
+    indicator = np.zeros((len(tag_sets), len(vocabulary)), dtype=FEATURE_DTYPE)
+    indicator[rows, cols] = 1.0
+    return indicator
+
+
+def jaccard_matrix(indicator1: np.ndarray, indicator2: np.ndarray) -> np.ndarray:
+    """
+    Compute Jaccard similarity between every row of indicator1 and every row
+    of indicator2 (tag indicator matrices over the same columns).
+    Intersection sizes for all pairs are indicator1 @ indicator2.T and the
+    union sizes follow from the row sums. Two empty sets score 1.0 (they
+    are identical); one empty and one non-empty set score 0.0.
+    """
+    intersection = indicator1 @ indicator2.T
+    union = np.add.outer(indicator1.sum(axis=1), indicator2.sum(axis=1))
+    union -= intersection
     
-    return intersection / union if union > 0 else 0.0
+    # union == 0 only when both sets are empty, which counts as identical;
+    # make those 1/1 so a single in-place divide covers every pair
+    empty = union == 0
+    intersection[empty] = 1.0
+    union[empty] = 1.0
+    intersection /= union
+    return intersection
 
 
-def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
-    """Compute cosine similarity between two vectors."""
-    if len(vec1) != len(vec2):
+def unit_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scale each row to unit length so cosine similarity between any two
+    rows is a plain dot product (and a whole block of them one matmul).
+    Zero rows stay zero, so their cosine with any row is 0.0.
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def _as_float(value: Any) -> float:
+    """Convert a feature value to float, defaulting to 0 if missing/invalid."""
+    try:
+        return float(value) if value is not None else 0.0
+    except (ValueError, TypeError):
         return 0.0
+
+
+def numeric_feature_matrix(games: List[GameDetails]) -> np.ndarray:
+    """
+    Extract NUMERIC_FEATURES for all games as one contiguous array and
+    z-score each column (population std; constant columns are only centered).
+    Returns a len(games) x len(NUMERIC_FEATURES) array, row-aligned with games.
+    """
+    n_features = len(NUMERIC_FEATURES)
+    values = np.fromiter(
+        (_as_float(getattr(game, feature)) for game in games for feature in NUMERIC_FEATURES),
+        dtype=np.float64, count=len(games) * n_features
+    ).reshape(len(games), n_features)
     
-    # Compute dot product and magnitudes
-    dot_product = sum(a * b for a, b in zip(vec1, vec2))
-    magnitude1 = math.sqrt(sum(a * a for a in vec1))
-    magnitude2 = math.sqrt(sum(b * b for b in vec2))
+    if not games:
+        return values
     
-    # Handle zero vectors
-    if magnitude1 == 0 or magnitude2 == 0:
-        return 0.0
+    # Compute mean and std per column for normalization (avoid division by zero)
+    means = values.mean(axis=0)
+    stds = values.std(axis=0)
+    stds[stds == 0] = 1.0
+    return (values - means) / stds
+
+
+@dataclass
+class FeatureBundle:
+    """
+    Similarity features for a set of games, built once and row-aligned with
+    `ids`, so any two blocks of games can be compared with matrix products.
+    Numeric features are normalized across the whole set.
+    """
+    ids: np.ndarray  # game ids (object array, so row selections fancy-index)
+    index: Dict[str, int]
+    numeric: np.ndarray  # normalized numeric features scaled to unit rows (FEATURE_DTYPE)
+    mechanics: np.ndarray  # tag indicator matrix (FEATURE_DTYPE)
+    categories: np.ndarray  # tag indicator matrix (FEATURE_DTYPE)
+
+
+def build_feature_bundle(games: Dict[str, GameDetails]) -> FeatureBundle:
+    """Extract and normalize the similarity features of all games at once."""
+    ids = list(games.keys())
+    records = list(games.values())
     
-    return dot_product / (magnitude1 * magnitude2)
-
-
-def normalize_numeric_features(games: Dict[str, Dict[str, Any]]) -> Dict[str, List[float]]:
-    """
-    Extract and normalize numeric features for all games.
-    Returns dict mapping game_id -> normalized feature vector.
-    """
-    feature_names = ["averagerating", "averageweight", "playingtime", "minplayers", "maxplayers", "minage"]
-    
-    # Extract all values for normalization
-    all_values = {name: [] for name in feature_names}
-    game_features = {}
-    
-    for game_id, game in games.items():
-        features = []
-        for feature in feature_names:
-            value = game.get(feature)
-            # Convert to float, default to 0 if missing/invalid
-            try:
-                value = float(value) if value is not None else 0.0
-            except (ValueError, TypeError):
-                value = 0.0
-            features.append(value)
-            all_values[feature].append(value)
-        
-        game_features[game_id] = features
-    
-    # Compute mean and std for normalization (avoid division by zero)
-    means = []
-    stds = []
-    for feature in feature_names:
-        values = all_values[feature]
-        mean = sum(values) / len(values) if values else 0.0
-        variance = sum((x - mean) ** 2 for x in values) / len(values) if values else 0.0
-        std = math.sqrt(variance) if variance > 0 else 1.0
-        means.append(mean)
-        stds.append(std)
-    
-    # Normalize all features
-    normalized_features = {}
-    for game_id, features in game_features.items():
-        normalized = [(features[i] - means[i]) / stds[i] for i in range(len(features))]
-        normalized_features[game_id] = normalized
-    
-    return normalized_features
-
-
-def compute_game_similarity(game1: Dict[str, Any], game2: Dict[str, Any], 
-                          normalized_features1: List[float], normalized_features2: List[float],
-                          mechanics_weight: float = 0.5, 
-                          categories_weight: float = 0.3, 
-                          numeric_weight: float = 0.2) -> float:
-    """
-    Compute similarity between two games using weighted combination of:
+    return FeatureBundle(
+        ids=np.array(ids, dtype=object),
+        index={gid: row for row, gid in enumerate(ids)},
+        # Normalize in float64, then store the unit rows as FEATURE_DTYPE
+        numeric=unit_rows(numeric_feature_matrix(records)).astype(FEATURE_DTYPE),
+        mechanics=tag_indicator_matrix([_tag_names(game.mechanics) for game in records]),
+        categories=tag_indicator_matrix([_tag_names(game.categories) for game in records]),
+    )
+
+
+def _select_rows(matrix: np.ndarray, rows: Rows) -> np.ndarray:
+    return matrix if rows is None else matrix[rows]
+
+
+def _tag_similarity_block(bundle: FeatureBundle, rows1: Rows, rows2: Rows,
+                          mechanics_scale: float, categories_scale: float) -> np.ndarray:
+    """
+    Weighted mechanics + categories Jaccard part of similarity_block, with
+    weights already divided by the total weight. Accumulates in place into
+    the mechanics buffer so no extra block-sized temporaries are made.
+    """
+    similarity = jaccard_matrix(_select_rows(bundle.mechanics, rows1), _select_rows(bundle.mechanics, rows2))
+    similarity *= mechanics_scale
+    
+    categories_sim = jaccard_matrix(_select_rows(bundle.categories, rows1), _select_rows(bundle.categories, rows2))
+    categories_sim *= categories_scale
+    similarity += categories_sim
+    return similarity
+
+
+def similarity_block(bundle: FeatureBundle,
+                     rows1: Rows = None, rows2: Rows = None,
+                     mechanics_weight: float = 0.5,
+                     categories_weight: float = 0.3,
+                     numeric_weight: float = 0.2) -> np.ndarray:
+    """
+    Compute the weighted similarity between every game in rows1 and every
+    game in rows2 of the bundle (all rows when None), combining:
     - Jaccard similarity of mechanics (50%)
-    - Jaccard similarity of categories (30%) 
+    - Jaccard similarity of categories (30%)
     - Cosine similarity of normalized numeric features (20%)
+    Returns a len(rows1) x len(rows2) matrix.
     """
-    
-    # Extract mechanics and categories as sets of names
-    mechanics1 = set(m.get("name", "") for m in game1.get("mechanics", []) if m.get("name"))
-    mechanics2 = set(m.get("name", "") for m in game2.get("mechanics", []) if m.get("name"))
-    
-    categories1 = set(c.get("name", "") for c in game1.get("categories", []) if c.get("name"))
-    categories2 = set(c.get("name", "") for c in game2.get("categories", []) if c.get("name"))
-    
-    # Compute component similarities
-    mechanics_sim = jaccard_similarity(mechanics1, mechanics2)
-    categories_sim = jaccard_similarity(categories1, categories2)
-    numeric_sim = cosine_similarity(normalized_features1, normalized_features2)
-    
-    # Weighted combination
+    # Weighted combination for all pairs at once
     total_weight = mechanics_weight + categories_weight + numeric_weight
-    similarity = (
-        mechanics_weight * mechanics_sim + 
-        categories_weight * categories_sim + 
-        numeric_weight * numeric_sim
-    ) / total_weight
+    similarity = _tag_similarity_block(
+        bundle, rows1, rows2, mechanics_weight / total_weight, categories_weight / total_weight
+    )
     
+    numeric_sim = _select_rows(bundle.numeric, rows1) @ _select_rows(bundle.numeric, rows2).T
+    numeric_sim *= numeric_weight / total_weight
+    similarity += numeric_sim
     return similarity
 
 
-def compute_similarity_edges(games: Dict[str, Dict[str, Any]], 
+def _export_scores(scores: np.ndarray) -> List[float]:
+    """Convert FEATURE_DTYPE scores to Python floats rounded to SCORE_DECIMALS."""
+    return np.round(scores.astype(np.float64), SCORE_DECIMALS).tolist()
+
+
+def _tag_names(tags: List[Dict[str, str]]) -> FrozenSet[str]:
+    """Return the set of non-empty names from a list of link dicts."""
+    return frozenset(t.get("name", "") for t in tags if t.get("name"))
+
+
+def compute_similarity_edges(games: Dict[str, GameDetails], 
                            edge_threshold: float = 0.35,
                            mechanics_weight: float = 0.5,
                            categories_weight: float = 0.3, 
@@ -128,47 +205,63 @@ def compute_similarity_edges(games: Dict[str, Dict[str, Any]],
     Compute pairwise similarities between all games and return edges above threshold.
     Returns list of (game_id1, game_id2, similarity_score) tuples.
     """
-    game_ids = list(games.keys())
-    n_games = len(game_ids)
+    n_games = len(games)
     
     log.info(f"Computing similarities for {n_games} games...")
     
-    # Normalize numeric features once
-    normalized_features = normalize_numeric_features(games)
+    bundle = build_feature_bundle(games)
     
-    edges = []
-    comparisons = 0
-    total_comparisons = n_games * (n_games - 1) // 2
+    total_weight = mechanics_weight + categories_weight + numeric_weight
+    numeric_scale = numeric_weight / total_weight
     
-    # Compute pairwise similarities
-    for i in range(n_games):
-        for j in range(i + 1, n_games):
-            id1, id2 = game_ids[i], game_ids[j]
-            
-            similarity = compute_game_similarity(
-                games[id1], games[id2],
-                normalized_features[id1], normalized_features[id2],
-                mechanics_weight, categories_weight, numeric_weight
+    # Score the upper triangle tile by tile (diagonal tiles included), keeping
+    # only pairs i < j above the threshold from each tile. Cosine adds at most
+    # numeric_scale, so the tag similarities alone rule out most pairs and the
+    # cosine is only computed for the pairs that can still reach the threshold.
+    tile = SIMILARITY_TILE_SIZE
+    row_parts, col_parts, weight_parts = [], [], []
+    for start1 in range(0, n_games, tile):
+        for start2 in range(start1, n_games, tile):
+            tags = _tag_similarity_block(
+                bundle, slice(start1, start1 + tile), slice(start2, start2 + tile),
+                mechanics_weight / total_weight, categories_weight / total_weight
             )
+            candidates = tags >= edge_threshold - numeric_scale
+            if start1 == start2:
+                candidates = np.triu(candidates, k=1)
+            rows, cols = np.nonzero(candidates)
+            if not len(rows):
+                continue
             
-            if similarity >= edge_threshold:
-                edges.append((id1, id2, similarity))
-            
-            comparisons += 1
+            weights = tags[rows, cols]
+            rows += start1
+            cols += start2
+            numeric_sim = np.einsum("ij,ij->i", bundle.numeric[rows], bundle.numeric[cols])
+            weights += numeric_scale * numeric_sim
             
-            # Progress logging for large collections
-            if comparisons % 1000 == 0:
-                log.info(f"Computed {comparisons}/{total_comparisons} similarities ({comparisons/total_comparisons*100:.1f}%)")
+            keep = weights >= edge_threshold
+            row_parts.append(rows[keep])
+            col_parts.append(cols[keep])
+            weight_parts.append(weights[keep])
     
-    # Sort by similarity score descending
-    edges.sort(key=lambda x: x[2], reverse=True)
+    if weight_parts:
+        rows, cols, weights = (np.concatenate(parts) for parts in (row_parts, col_parts, weight_parts))
+    else:
+        rows = cols = np.empty(0, dtype=np.intp)
+        weights = np.empty(0, dtype=FEATURE_DTYPE)
+    
+    # Strongest first; ties keep (i, j) pair order regardless of tiling
+    order = np.lexsort((cols, rows, -weights))
+    rows, cols, weights = rows[order], cols[order], weights[order]
+    
+    edges = list(zip(bundle.ids[rows].tolist(), bundle.ids[cols].tolist(), _export_scores(weights)))
     
     log.info(f"Found {len(edges)} edges above threshold {edge_threshold}")
     return edges
 
 
-def compute_cross_similarities(owned_games: Dict[str, Dict[str, Any]], 
-                              candidate_games: Dict[str, Dict[str, Any]],
+def compute_cross_similarities(owned_games: Dict[str, GameDetails], 
+                              candidate_games: Dict[str, GameDetails],
                               top_k: int = 5,
                               mechanics_weight: float = 0.5,
                               categories_weight: float = 0.3,
@@ -179,43 +272,40 @@ def compute_cross_similarities(owned_games: Dict[str, Dict[str, Any]],
     """
     log.info(f"Computing cross-similarities between {len(owned_games)} owned and {len(candidate_games)} candidate games...")
     
-    # Combine all games for feature normalization
-    all_games = {**owned_games, **candidate_games}
-    normalized_features = normalize_numeric_features(all_games)
+    # Build features once over owned + candidates (shared normalization),
+    # then score every owned/candidate pair with one block computation
+    bundle = build_feature_bundle({**owned_games, **candidate_games})
+    
+    # Skip candidates that are already owned
+    candidate_ids = [cid for cid in candidate_games if cid not in owned_games]
+    scores = similarity_block(
+        bundle,
+        [bundle.index[gid] for gid in owned_games],
+        [bundle.index[cid] for cid in candidate_ids],
+        mechanics_weight, categories_weight, numeric_weight
+    )
     
     recommendations = {}
     
-    for owned_id, owned_game in owned_games.items():
-        candidates_with_scores = []
-        
-        for candidate_id, candidate_game in candidate_games.items():
-            # Skip if candidate is already owned
-            if candidate_id in owned_games:
-                continue
-                
-            similarity = compute_game_similarity(
-                owned_game, candidate_game,
-                normalized_features[owned_id], normalized_features[candidate_id],
-                mechanics_weight, categories_weight, numeric_weight
-            )
-            
-            candidates_with_scores.append({
-                "id": candidate_id,
-                "name": candidate_game.get("name", ""),
-                "score": similarity,
-                "bggUrl": f"https://boardgamegeek.com/boardgame/{candidate_id}"
-            })
-        
-        # Sort by similarity and take top k
-        candidates_with_scores.sort(key=lambda x: x["score"], reverse=True)
-        recommendations[owned_id] = candidates_with_scores[:top_k]
+    for row, owned_id in enumerate(owned_games):
+        # Sort by similarity (stable, so ties keep candidate order) and take top k
+        top = np.argsort(-scores[row], kind="stable")[:top_k]
+        recommendations[owned_id] = [
+            {
+                "id": candidate_ids[col],
+                "name": candidate_games[candidate_ids[col]].name,
+                "score": score,
+                "bggUrl": f"https://boardgamegeek.com/boardgame/{candidate_ids[col]}"
+            }
+            for col, score in zip(top.tolist(), _export_scores(scores[row, top]))
+        ]
     
     log.info(f"Generated recommendations for {len(recommendations)} owned games")
     return recommendations
 
 
-def find_similar_owned_games(target_game: Dict[str, Any], 
-                           owned_games: Dict[str, Dict[str, Any]],
+def find_similar_owned_games(target_game: GameDetails, 
+                           owned_games: Dict[str, GameDetails],
                            top_k: int = 10,
                            mechanics_weight: float = 0.5,
                            categories_weight: float = 0.3,
@@ -224,22 +314,18 @@ def find_similar_owned_games(target_game: Dict[str, Any],
     Find owned games most similar to a target game.
     Used for finding games similar to candidates for recommendation scoring.
     """
-    all_games = {**owned_games, "target": target_game}
-    normalized_features = normalize_numeric_features(all_games)
-    
-    similarities = []
-    for owned_id, owned_game in owned_games.items():
-        similarity = compute_game_similarity(
-            target_game, owned_game,
-            normalized_features["target"], normalized_features[owned_id],
-            mechanics_weight, categories_weight, numeric_weight
-        )
-        
-        similarities.append({
-            "id": owned_id,
-            "name": owned_game.get("name", ""),
-            "score": similarity
-        })
+    bundle = build_feature_bundle({**owned_games, "target": target_game})
+    scores = similarity_block(
+        bundle,
+        [bundle.index["target"]],
+        [bundle.index[gid] for gid in owned_games],
+        mechanics_weight, categories_weight, numeric_weight
+    )[0]
+    
+    similarities = [
+        {"id": owned_id, "name": owned_game.name, "score": score}
+        for (owned_id, owned_game), score in zip(owned_games.items(), _export_scores(scores))
+    ]
     
     similarities.sort(key=lambda x: x["score"], reverse=True)
     return similarities[:top_k]
\ No newline at end of file